@@ -1,16 +1,58 @@
 import socket
 import time
-import random
-import string
+import os
+import base64
 import argparse
+import numpy as np
 
-def generate_random_string(min_size=10, max_size=1024):
-    """Generate a random string of random length between min_size and max_size."""
-    size = random.randint(min_size, max_size)
-    return ''.join(random.choice(string.ascii_letters + string.digits) for _ in range(size))
+# Upper bound on buffers handed to a single sendmsg call (Linux IOV_MAX)
+IOV_MAX = 1024
+
+# Kernel socket buffer size, large enough to absorb a whole burst
+SOCKET_BUFFER_SIZE = 1 << 20
+
+# Random decisions drawn per batch when precomputing the traffic schedule
+SCHEDULE_LENGTH = 4096
+
+def schedule(draw, length=SCHEDULE_LENGTH):
+    """Yield values from draw(length) one at a time, drawing a fresh batch when exhausted."""
+    while True:
+        yield from draw(length).tolist()
+
+def generate_random_bytes(size):
+    """Generate a random ASCII payload of the given size."""
+    # base64 keeps the payload printable; 3 random bytes encode to 4 characters
+    return base64.b64encode(os.urandom((size * 3 + 3) // 4))[:size]
+
+def precise_sleep(deadline):
+    """Sleep until the time.monotonic() deadline: coarse sleep, then spin the last millisecond."""
+    remaining = deadline - time.monotonic()
+    if remaining > 2e-3:
+        time.sleep(remaining - 1e-3)
+    while time.monotonic() < deadline:
+        pass
+
+def send_buffers(sock, buffers):
+    """Write a list of buffers, using one scatter-gather sendmsg where available."""
+    if not hasattr(sock, 'sendmsg'):
+        # No sendmsg (e.g. Windows): fall back to a single concatenated write
+        sock.sendall(b''.join(buffers))
+        return
+    
+    views = [memoryview(buf) for buf in buffers]
+    start = 0
+    while start < len(views):
+        sent = sock.sendmsg(views[start:start + IOV_MAX])
+        # Skip fully written buffers and trim a partially written one
+        while start < len(views) and sent >= len(views[start]):
+            sent -= len(views[start])
+            start += 1
+        if sent:
+            views[start] = views[start][sent:]
 
 def send_messages(base_interval=0.5, min_interval=0.1, burst_probability=0.1, 
-                  burst_messages=10, burst_interval=0.01, min_size=10, max_size=1024):
+                  burst_messages=10, burst_interval=0.01, min_size=10, max_size=1024,
+                  write_buffer_size=1400, flush_interval=0.05):
     """
     Send random traffic to the server continuously.
     
@@ -22,32 +64,65 @@ def send_messages(base_interval=0.5, min_interval=0.1, burst_probability=0.1,
         burst_interval (float): Time interval between messages during a burst
         min_size (int): Minimum message size in bytes
         max_size (int): Maximum message size in bytes
+        write_buffer_size (int): Flush buffered single messages once this many bytes are pending
+        flush_interval (float): Maximum time in seconds a buffered single message may wait;
+            single messages only batch when intervals are shorter than this
     """
     client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    # Set buffer sizes before connecting so the receive window is scaled for them
+    client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER_SIZE)
+    client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_SIZE)
     client_socket.connect(('127.0.0.1', 12345))
+    # Batching happens in userspace, so put every write on the wire immediately
+    client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
     
     message_count = 0
     
+    # Precompute burst decisions, message sizes and intervals in vectorized batches
+    rng = np.random.default_rng()
+    low_interval, high_interval = sorted((min_interval, base_interval))
+    bursts = schedule(lambda n: rng.random(n) < burst_probability)
+    sizes = schedule(lambda n: rng.integers(min_size, max_size, size=n, endpoint=True))
+    # Random interval between messages, but at least min_interval
+    intervals = schedule(lambda n: np.maximum(min_interval, rng.uniform(low_interval, high_interval, size=n)))
+    
+    # Userspace write buffer so several messages go out in one sendall
+    write_buffer = bytearray()
+    flush_deadline = None
+    
     try:
         print("Starting to send messages. Press Ctrl+C to stop.")
         while True:  # Run indefinitely until interrupted
             # Decide whether to send a burst of messages or a single message
-            if random.random() < burst_probability:
+            if next(bursts):
                 print(f"Sending burst of {burst_messages} messages...")
-                # Send a burst of messages
-                for _ in range(burst_messages):
-                    message = f"Message {message_count}: {generate_random_string(min_size, max_size)}"
-                    client_socket.sendall(message.encode())
-                    message_count += 1
-                    time.sleep(burst_interval)  # Very small delay during burst
+                burst_deadline = time.monotonic() + burst_interval * burst_messages
+                # Write the whole burst (after anything still pending) in one call
+                burst = [write_buffer] if write_buffer else []
+                burst += [b"Message %d: %s" % (message_count + i, generate_random_bytes(next(sizes)))
+                          for i in range(burst_messages)]
+                message_count += burst_messages
+                send_buffers(client_socket, burst)
+                write_buffer = bytearray()
+                flush_deadline = None
+                # Keep the burst's overall pacing now that it is a single write
+                precise_sleep(burst_deadline)
             else:
                 # Send a single message with random content
-                message = f"Message {message_count}: {generate_random_string(min_size, max_size)}"
-                client_socket.sendall(message.encode())
+                message = b"Message %d: %s" % (message_count, generate_random_bytes(next(sizes)))
+                if flush_deadline is None:
+                    flush_deadline = time.monotonic() + flush_interval
+                write_buffer += message
                 message_count += 1
                 
-                # Random interval between messages, but at least min_interval
-                interval = max(min_interval, random.uniform(min_interval, base_interval))
+                interval = next(intervals)
+                
+                # Flush when the buffer is full or would outlive its deadline while sleeping
+                if (len(write_buffer) >= write_buffer_size
+                        or time.monotonic() + interval >= flush_deadline):
+                    client_socket.sendall(write_buffer)
+                    write_buffer.clear()
+                    flush_deadline = None
                 time.sleep(interval)
                 
             # Print status every 100 messages
@@ -57,6 +132,8 @@ def send_messages(base_interval=0.5, min_interval=0.1, burst_probability=0.1,
     except KeyboardInterrupt:
         print(f"\nStopping after sending {message_count} messages")
     finally:
+        if write_buffer:
+            client_socket.sendall(write_buffer)
         client_socket.close()
 
 if __name__ == "__main__":
@@ -75,6 +152,11 @@ if __name__ == "__main__":
                         help='Minimum message size in bytes (default: 10)')
     parser.add_argument('--max-size', type=int, default=1024,
                         help='Maximum message size in bytes (default: 1024)')
+    parser.add_argument('--write-buffer-size', type=int, default=1400,
+                        help='Bytes of single messages to buffer before flushing (default: 1400)')
+    parser.add_argument('--flush-interval', type=float, default=0.05,
+                        help='Maximum time a buffered message may wait in seconds; single messages '
+                             'only batch when --min-interval is below this (default: 0.05)')
     
     args = parser.parse_args()
     
@@ -85,5 +167,7 @@ if __name__ == "__main__":
         burst_messages=args.burst_messages,
         burst_interval=args.burst_interval,
         min_size=args.min_size,
-        max_size=args.max_size
+        max_size=args.max_size,
+        write_buffer_size=args.write_buffer_size,
+        flush_interval=args.flush_interval
     )
@@ -1,17 +1,24 @@
 import matplotlib.pyplot as plt
 from matplotlib.animation import FuncAnimation
-import threading
-import pyshark
+from scapy.all import AsyncSniffer, IP, IPv6, TCP
 import time
 import numpy as np
 import argparse
-from collections import deque
 import matplotlib.dates as mdates
 from matplotlib.gridspec import GridSpec
 from matplotlib.patches import Rectangle
 
+# Rows of the history ring buffer
+TIME, CWND, RTT, THROUGHPUT, CONGESTION = range(5)
+
+# Unacknowledged segments remembered for RTT matching
+MAX_PENDING_SEGMENTS = 10000
+
+# Recompute the throughput axis limits every this many frames
+AUTOSCALE_EVERY = 10
+
 class CongestionVisualizer:
-    def __init__(self, interface='lo0', display_filter='tcp', history_length=100, 
+    def __init__(self, interface='lo0', capture_filter='tcp', history_length=100, 
                  congestion_threshold_rtt=100, congestion_threshold_cwnd=0.7):
         # Create figure with subplots arranged in a grid
         self.fig = plt.figure(figsize=(12, 10))
@@ -23,51 +30,64 @@ class CongestionVisualizer:
         self.ax_throughput = self.fig.add_subplot(self.gs[1, :])
         self.ax_congestion = self.fig.add_subplot(self.gs[2, :])
         
-        # Set up data storage with fixed buffer size
+        # Set up data storage with fixed buffer size: one ring buffer row per metric,
+        # with self.head pointing at the slot the next sample is written to. Each sample
+        # is written twice, at head and head + history_length, so the last history_length
+        # samples are always the contiguous, time-ordered slice returned by history_view()
         self.history_length = history_length
-        self.time_values = deque(maxlen=history_length)
+        self.history = np.full((5, 2 * history_length), np.nan)
+        self.head = 0
         
         # TCP Window Size data
-        self.cwnd_values = deque(maxlen=history_length)
         self.max_cwnd = 1000  # Initial value, will be updated
         self.line_cwnd, = self.ax_cwnd.plot([], [], 'b-', linewidth=1.5, label='Window Size')
         
         # RTT data
-        self.rtt_values = deque(maxlen=history_length)
         self.line_rtt, = self.ax_rtt.plot([], [], 'g-', linewidth=1.5, label='RTT')
         
         # Throughput data (packets per second)
-        self.throughput_values = deque(maxlen=history_length)
-        self.packet_count = 0
-        self.last_throughput_time = time.time()
+        self.last_throughput_time = 0.0  # seconds since start_time, like current_time
+        self._frame_idx = 0
         self.line_throughput, = self.ax_throughput.plot([], [], 'r-', linewidth=1.5, label='Throughput')
         
         # Congestion indicator (combined metric)
-        self.congestion_values = deque(maxlen=history_length)
         self.congestion_threshold_rtt = congestion_threshold_rtt  # ms
         self.congestion_threshold_cwnd = congestion_threshold_cwnd  # fraction of max
         self.line_congestion, = self.ax_congestion.plot([], [], 'purple', linewidth=1.5, label='Congestion Indicator')
-        self.congestion_events = []  # Store times when congestion was detected
         
         # Initialize plots
         self._setup_plots()
         
-        # Synchronization
-        self.lock = threading.Lock()
+        # Red congestion bars: a fixed pool of one Rectangle per history slot on each axis,
+        # shown or hidden as slots are rewritten so the artist count never grows
+        self.congestion_spans = []
+        for ax in [self.ax_cwnd, self.ax_rtt, self.ax_throughput, self.ax_congestion]:
+            spans = [Rectangle((0, 0), 0.5, 1, transform=ax.get_xaxis_transform(),
+                               alpha=0.3, color='red', visible=False)
+                     for _ in range(history_length)]
+            for span in spans:
+                ax.add_patch(span)
+            self.congestion_spans.append(spans)
+        
+        # Packets seen, written only by the capture thread; update_plot diffs it
+        # against the count at the previous frame instead of resetting it
+        self.packet_count = 0
+        self._counted_packets = 0
         self.start_time = time.time()
         
-        # Latest values (updated by capture thread)
+        # Latest values (written only by the capture thread)
         self.latest_cwnd = None
         self.latest_rtt = None
         self.interface = interface
-        self.display_filter = display_filter
+        self.capture_filter = capture_filter
+        
+        # Send time of each unacknowledged segment, keyed by the ACK that will cover it
+        self.pending_segments = {}
+        self.sniffer = None
+        self._capture_failed = False
         
-        # Initialize with some dummy data to avoid empty array errors
-        self.time_values.append(0)
-        self.cwnd_values.append(0)
-        self.rtt_values.append(0)
-        self.throughput_values.append(0)
-        self.congestion_values.append(0)
+        # Initialize with a zero sample so the plots start at the origin
+        self.append_sample(0, 0, 0, 0, 0)
         
     def _setup_plots(self):
         # Setup TCP Window Size plot
@@ -115,170 +135,152 @@ class CongestionVisualizer:
         self.fig.suptitle('Network Traffic Congestion Monitor', fontsize=16)
         self.fig.subplots_adjust(top=0.92)
     
-    def calculate_congestion(self, rtt, cwnd):
-        """Calculate a congestion indicator based on RTT and CWND."""
-        if rtt is None or cwnd is None:
-            return None
-            
-        # Normalize RTT (higher is worse)
-        norm_rtt = min(1.0, rtt / self.congestion_threshold_rtt)
-        
-        # Normalize CWND (lower is worse)
-        if self.max_cwnd > 0:
-            norm_cwnd = 1.0 - min(1.0, cwnd / self.max_cwnd)
-        else:
-            norm_cwnd = 0
-            
-        # Combined metric (simple average)
-        return (norm_rtt + norm_cwnd) / 2
+    def append_sample(self, t, cwnd, rtt, throughput, congestion):
+        """Write one sample per metric into the ring buffer; None is stored as NaN."""
+        sample = [np.nan if value is None else value
+                  for value in (t, cwnd, rtt, throughput, congestion)]
+        self.history[:, self.head] = sample
+        self.history[:, self.head + self.history_length] = sample
+        self.head = (self.head + 1) % self.history_length
+    
+    def history_view(self):
+        """Return a view of the last history_length samples per metric, oldest first."""
+        return self.history[:, self.head:self.head + self.history_length]
     
     def update_plot(self, frame):
+        self.check_capture()
         current_time = time.time() - self.start_time
         is_congested = False
         
-        with self.lock:
-            # Calculate throughput
-            packets_since_last = self.packet_count
-            self.packet_count = 0
-            time_elapsed = current_time - self.last_throughput_time
-            if time_elapsed > 0:
-                throughput = packets_since_last / time_elapsed
-                self.throughput_values.append(throughput)
-                self.last_throughput_time = current_time
-            
-            # Update time values
-            self.time_values.append(current_time)
-            
-            # Update window size if available
-            if self.latest_cwnd is not None:
-                self.cwnd_values.append(self.latest_cwnd)
-                # Update max window size seen
-                if self.latest_cwnd > self.max_cwnd:
-                    self.max_cwnd = self.latest_cwnd
-                    self.ax_cwnd.set_ylim(0, self.max_cwnd * 1.1)
-            else:
-                # Maintain the array size
-                self.cwnd_values.append(None)
-            
-            # Update RTT if available
-            if self.latest_rtt is not None:
-                self.rtt_values.append(self.latest_rtt)
-                # Auto-adjust y-axis if needed
-                if self.latest_rtt > self.ax_rtt.get_ylim()[1]:
-                    self.ax_rtt.set_ylim(0, self.latest_rtt * 1.5)
-            else:
-                # Maintain the array size
-                self.rtt_values.append(None)
-            
-            # Calculate congestion indicator
-            congestion = self.calculate_congestion(self.latest_rtt, self.latest_cwnd)
-            if congestion is not None:
-                self.congestion_values.append(congestion)
-                # Check if we're in a congested state
-                if congestion > 0.7:  # Threshold for congestion
-                    is_congested = True
-                    self.congestion_events.append(current_time)
-            else:
-                # Maintain the array size
-                self.congestion_values.append(None)
-        
-        # Update plots
-        time_list = list(self.time_values)
-        
-        # Update TCP Window Size plot
-        self.line_cwnd.set_data(time_list, list(self.cwnd_values))
-        self.ax_cwnd.relim()
-        self.ax_cwnd.autoscale_view(scalex=True, scaley=False)
-        
-        # Update RTT plot
-        self.line_rtt.set_data(time_list, list(self.rtt_values))
-        self.ax_rtt.relim()
-        self.ax_rtt.autoscale_view(scalex=True, scaley=False)
-        
-        # Update Throughput plot
-        self.line_throughput.set_data(time_list, list(self.throughput_values))
-        self.ax_throughput.relim()
-        self.ax_throughput.autoscale_view(scalex=True, scaley=True)
-        
-        # Update Congestion Indicator plot
-        self.line_congestion.set_data(time_list, list(self.congestion_values))
-        self.ax_congestion.relim()
-        self.ax_congestion.autoscale_view(scalex=True, scaley=False)
-        
-        # Add red background for congestion events
-        if is_congested:
-            for ax in [self.ax_cwnd, self.ax_rtt, self.ax_throughput, self.ax_congestion]:
-                # Add a red vertical bar for the current time
-                ax.axvspan(current_time-0.5, current_time, alpha=0.3, color='red')
+        # Snapshot the capture thread's values; single attribute reads are atomic
+        # under the GIL, and a sample landing mid-snapshot just shows up next frame
+        packet_count = self.packet_count
+        packets_since_last = packet_count - self._counted_packets
+        self._counted_packets = packet_count
+        latest_cwnd = self.latest_cwnd
+        latest_rtt = self.latest_rtt
+        
+        # Calculate throughput
+        throughput = None
+        time_elapsed = current_time - self.last_throughput_time
+        if time_elapsed > 0:
+            throughput = packets_since_last / time_elapsed
+            self.last_throughput_time = current_time
+        
+        # Update max window size seen
+        if latest_cwnd is not None and latest_cwnd > self.max_cwnd:
+            self.max_cwnd = latest_cwnd
+            self.ax_cwnd.set_ylim(0, self.max_cwnd * 1.1)
+        
+        # Auto-adjust RTT y-axis if needed
+        if latest_rtt is not None and latest_rtt > self.ax_rtt.get_ylim()[1]:
+            self.ax_rtt.set_ylim(0, latest_rtt * 1.5)
+        
+        # Missing values are stored as NaN to keep the rows aligned
+        self.append_sample(current_time, latest_cwnd, latest_rtt,
+                           throughput, None)
+        
+        # Calculate the congestion indicator for the whole visible history at once:
+        # normalized RTT (higher is worse) averaged with normalized CWND (lower is worse).
+        # max_cwnd starts at 1000 and only grows, so the division is safe; NaN inputs stay NaN.
+        # Only the viewed copy of each slot is updated, but it is recomputed every frame
+        history = self.history_view()
+        norm_rtt = np.minimum(1.0, history[RTT] / self.congestion_threshold_rtt)
+        norm_cwnd = 1.0 - np.minimum(1.0, history[CWND] / self.max_cwnd)
+        history[CONGESTION] = (norm_rtt + norm_cwnd) / 2
+        
+        # Check if we're in a congested state
+        congestion = history[CONGESTION, -1]
+        if congestion > 0.7:  # Threshold for congestion
+            is_congested = True
+        
+        # Update plots straight from the time-ordered view, without copying
+        time_values = history[TIME]
+        
+        # Only the throughput y-axis is autoscaled; the x-axes are set explicitly below
+        # and the other y-axes are adjusted above when a new maximum arrives
+        self.line_cwnd.set_data(time_values, history[CWND])
+        self.line_rtt.set_data(time_values, history[RTT])
+        self.line_congestion.set_data(time_values, history[CONGESTION])
+        
+        # Update Throughput plot, rescaling periodically or as soon as it outgrows the axis
+        self.line_throughput.set_data(time_values, history[THROUGHPUT])
+        self._frame_idx += 1
+        if (self._frame_idx % AUTOSCALE_EVERY == 0
+                or (throughput is not None and throughput > self.ax_throughput.get_ylim()[1])):
+            # Set the limit directly: the initial set_ylim turned y-autoscaling off.
+            # Keep the initial 0-100 pps range as a floor so an idle link stays readable
+            peak = np.nanmax(history[THROUGHPUT], initial=0)
+            self.ax_throughput.set_ylim(0, max(100, peak * 1.1))
+        
+        # Show a red background bar for congestion events in the slot just written
+        slot = (self.head - 1) % self.history_length
+        visible_spans = []
+        for spans in self.congestion_spans:
+            span = spans[slot]
+            if is_congested:
+                span.set_x(current_time - 0.5)
+            span.set_visible(is_congested)
+            visible_spans.extend(s for s in spans if s.get_visible())
         
         # Adjust x-axis limits to show the latest data
-        if time_list:
-            x_min = max(0, time_list[-1] - 20)  # Show last 20 seconds
-            x_max = time_list[-1] + 1
-            for ax in [self.ax_cwnd, self.ax_rtt, self.ax_throughput, self.ax_congestion]:
-                ax.set_xlim(x_min, x_max)
+        x_min = max(0, current_time - 20)  # Show last 20 seconds
+        x_max = current_time + 1
+        for ax in [self.ax_cwnd, self.ax_rtt, self.ax_throughput, self.ax_congestion]:
+            ax.set_xlim(x_min, x_max)
                 
-        return (self.line_cwnd, self.line_rtt, self.line_throughput, self.line_congestion)
+        return (self.line_cwnd, self.line_rtt, self.line_throughput, self.line_congestion,
+                *visible_spans)
     
-    def capture_packets(self):
+    def process_packet(self, packet):
+        """Extract window size and RTT from one sniffed packet (runs on the sniffer thread)."""
         try:
-            print(f"DEBUG: Starting packet capture with:")
-            print(f"DEBUG: Interface: {self.interface}")
-            print(f"DEBUG: Display filter: {self.display_filter}")
+            self.packet_count += 1
+            if TCP not in packet:
+                return
+            tcp = packet[TCP]
+            ip = packet[IP] if IP in packet else packet[IPv6]
             
-            # Find tshark location using the 'which' command
-            import subprocess
-            try:
-                tshark_path = subprocess.check_output(['which', 'tshark']).decode().strip()
-                print(f"DEBUG: Found TShark at: {tshark_path}")
-            except Exception as e:
-                print(f"DEBUG: Couldn't determine TShark path: {e}")
-                tshark_path = '/opt/homebrew/bin/tshark'  # Default for macOS Homebrew
-                print(f"DEBUG: Using default TShark path: {tshark_path}")
+            # Extract TCP window size
+            self.latest_cwnd = tcp.window
             
-            capture = pyshark.LiveCapture(interface=self.interface, display_filter=self.display_filter, tshark_path=tshark_path)
-            capture.set_debug()
-            print(f"Starting packet capture on interface {self.interface} with filter '{self.display_filter}'...")
+            # Match this ACK against the segment it acknowledges to get the RTT
+            if tcp.flags.A:
+                sent_at = self.pending_segments.pop((ip.src, tcp.sport, ip.dst, tcp.dport, tcp.ack), None)
+                if sent_at is not None:
+                    self.latest_rtt = (float(packet.time) - sent_at) * 1000  # Convert to ms
             
-            for packet in capture.sniff_continuously():
-                try:
-                    # Update packet count for throughput calculation
-                    with self.lock:
-                        self.packet_count += 1
-                        
-                        # Extract TCP window size if available
-                        if hasattr(packet.tcp, 'window_size_value'):
-                            cwnd = int(packet.tcp.window_size_value)
-                            self.latest_cwnd = cwnd
-                            
-                        # Extract RTT if available
-                        if hasattr(packet.tcp, 'analysis_ack_rtt'):
-                            rtt = float(packet.tcp.analysis_ack_rtt) * 1000  # Convert to ms
-                            self.latest_rtt = rtt
-                
-                except AttributeError as e:
-                    # Some packets may not have all fields
-                    print(f"DEBUG: AttributeError - {e}")
-                    continue
-                except Exception as e:
-                    print(f"Error processing packet: {e}")
-                    print(f"DEBUG: Packet type: {type(packet)}")
-                    continue
-                    
+            # Remember segments that carry data (SYN and FIN count as one byte)
+            seg_len = len(tcp.payload) + (1 if tcp.flags.S or tcp.flags.F else 0)
+            if seg_len:
+                if len(self.pending_segments) >= MAX_PENDING_SEGMENTS:
+                    # Forget the oldest entry, e.g. segments covered by a cumulative ACK
+                    del self.pending_segments[next(iter(self.pending_segments))]
+                expected_ack = (tcp.seq + seg_len) & 0xFFFFFFFF
+                self.pending_segments[(ip.dst, tcp.dport, ip.src, tcp.sport, expected_ack)] = float(packet.time)
+        
         except Exception as e:
-            print(f"Error in packet capture: {e}")
-            import traceback
-            print(f"DEBUG: Full traceback: {traceback.format_exc()}")
+            print(f"Error processing packet: {e}")
     
     def start_capture(self):
-        # Start packet capture in a separate thread
-        thread = threading.Thread(target=self.capture_packets, daemon=True)
-        thread.start()
-        return thread
+        """Start sniffing in scapy's background thread, in-process (no tshark subprocess)."""
+        print(f"Starting packet capture on interface {self.interface} with filter '{self.capture_filter}'...")
+        self.sniffer = AsyncSniffer(iface=self.interface, filter=self.capture_filter,
+                                    prn=self.process_packet, store=False)
+        self.sniffer.start()
+        return self.sniffer
+    
+    def check_capture(self):
+        """Report a capture failure once; scapy stores it on the sniffer instead of raising."""
+        # A missing interface, missing permissions or a bad filter all end the
+        # sniffer thread right after start; without this the charts just stay empty
+        if self.sniffer is not None and not self._capture_failed and self.sniffer.exception is not None:
+            self._capture_failed = True
+            print(f"Error in packet capture: {self.sniffer.exception}")
         
     def animate(self, interval=100):  # refresh every 100ms
         """Start the animation with the given refresh interval."""
-        # Start packet capture in a background thread
+        # Start packet capture in the background
         self.start_capture()
         
         # Create animation that calls update_plot regularly
@@ -301,7 +303,7 @@ def parse_arguments():
                         help='Network interface to capture packets from (default: lo0)')
     
     parser.add_argument('--filter', type=str, default='tcp',
-                        help='Display filter for packet capture (default: tcp)')
+                        help='BPF capture filter, e.g. "tcp port 12345" (default: tcp)')
     
     parser.add_argument('--history', type=int, default=100,
                         help='Number of data points to keep in history (default: 100)')
@@ -324,7 +326,7 @@ if __name__ == "__main__":
     
     print(f"Starting Network Traffic Congestion Visualizer")
     print(f"Interface: {args.interface}")
-    print(f"Display filter: {args.filter}")
+    print(f"Capture filter: {args.filter}")
     print(f"History length: {args.history} data points")
     print(f"Update interval: {args.interval} ms")
     print(f"RTT congestion threshold: {args.rtt_threshold} ms")
@@ -333,7 +335,7 @@ if __name__ == "__main__":
     # Create and start the visualizer
     viz = CongestionVisualizer(
         interface=args.interface,
-        display_filter=args.filter,
+        capture_filter=args.filter,
         history_length=args.history,
         congestion_threshold_rtt=args.rtt_threshold,
         congestion_threshold_cwnd=args.cwnd_threshold
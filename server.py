@@ -1,45 +1,218 @@
+import asyncio
+import argparse
+import concurrent.futures
+import logging
+import os
 import socket
-import threading
-import datetime
+import time
 
-def handle_client(conn, addr):
-    print(f"Connected by {addr}")
+LOG_FILE = 'traffic_log.txt'
+
+# Kernel socket buffer size, inherited by accepted connections
+SOCKET_BUFFER_SIZE = 1 << 20
+
+# Bytes received per recv_into (or splice) call
+RECV_BUFFER_SIZE = 65536
+
+# os.splice (Linux, Python 3.10+) lets the echo stay inside the kernel
+HAS_SPLICE = hasattr(os, 'splice')
+
+# Worker threads in the event loop's default executor, used for blocking log writes
+THREAD_POOL_SIZE = int(os.getenv('THREAD_POOL_SIZE', '4'))
+
+logger = logging.getLogger(__name__)
+
+# Log entries waiting for the writer task; None asks it to stop
+_log_q = asyncio.Queue()
+
+# Last formatted log timestamp: [epoch second, encoded timestamp]
+_ts_cache = [None, b""]
+
+def log_timestamp():
+    """Return the current local time for log entries, formatting it at most once per second."""
+    now = int(time.time())
+    if now != _ts_cache[0]:
+        _ts_cache[0] = now
+        _ts_cache[1] = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(now)).encode()
+    return _ts_cache[1]
+
+def write_log(log_file, data):
+    """Write one batch of log entries (blocking; runs in the default executor)."""
+    try:
+        log_file.write(data)
+        log_file.flush()
+    except Exception as e:
+        logger.error("Error writing to log file: %s", e)
+
+async def log_writer(log_file):
+    """Drain queued log entries into log_file, one threaded write per batch."""
+    while True:
+        items = [await _log_q.get()]
+        while not _log_q.empty():
+            items.append(_log_q.get_nowait())
+
+        stop = None in items
+        await asyncio.to_thread(write_log, log_file, b''.join(item for item in items if item is not None))
+        if stop:
+            return
+
+def create_listen_socket(address):
+    """Create the non-blocking listening socket, sizing its buffers before listen()."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    # Accepted sockets inherit these, and setting them before the handshake lets the
+    # receive window be scaled for them (as the client does before connect)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER_SIZE)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_SIZE)
+    sock.bind(address)
+    sock.listen()
+    sock.setblocking(False)
+    return sock
+
+def configure_socket(sock):
+    """Apply the per-connection socket options."""
+    # Echo small messages right away instead of letting Nagle hold them back
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+def log_packet(nbytes):
+    """Queue a traffic_log.txt entry for one received chunk."""
+    # Log packet size and timestamp to traffic_log.txt
+    log_entry = b"%s,%d\n" % (log_timestamp(), nbytes)
+
+    # Hand the entry to the writer task instead of writing it here
+    _log_q.put_nowait(log_entry)
+
+    logger.debug("Received %d bytes", nbytes)
+
+class EchoProtocol(asyncio.BufferedProtocol):
+    """Echo each connection's data back, receiving into one pinned per-connection buffer."""
+
+    def __init__(self):
+        self.buf = bytearray(RECV_BUFFER_SIZE)
+        self.view = memoryview(self.buf)
+        self.transport = None
+        self.addr = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.addr = transport.get_extra_info('peername')
+        logger.info("Connected by %s", self.addr)
+        configure_socket(transport.get_extra_info('socket'))
+        # The transport keeps a view of self.buf for anything it could not send
+        # at once, so pause reading (see pause_writing) until it has fully drained
+        transport.set_write_buffer_limits(high=0)
+
+    def get_buffer(self, sizehint):
+        return self.view
+
+    def buffer_updated(self, nbytes):
+        log_packet(nbytes)
+        self.transport.write(self.view[:nbytes])
+
+    def pause_writing(self):
+        self.transport.pause_reading()
+
+    def resume_writing(self):
+        self.transport.resume_reading()
+
+    def connection_lost(self, exc):
+        if isinstance(exc, ConnectionResetError):
+            logger.info("Connection with %s closed by client.", self.addr)
+
+async def wait_fd(add, remove, fd):
+    """Wait until fd is ready, using loop.add_reader/add_writer and the matching remove."""
+    fut = asyncio.get_running_loop().create_future()
+    add(fd, lambda: fut.done() or fut.set_result(None))
+    try:
+        await fut
+    finally:
+        remove(fd)
+
+async def splice_echo(conn, addr):
+    """Echo one connection through a pipe with os.splice, never copying into userspace."""
+    loop = asyncio.get_running_loop()
+    fd = conn.fileno()
+    pipe_r, pipe_w = os.pipe()
+    flags = os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK
     try:
         while True:
-            data = conn.recv(1024)
-            if not data:
-                break
-            
-            # Log packet size and timestamp to traffic_log.txt
-            packet_size = len(data)
-            timestamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            log_entry = f"{timestamp},{packet_size}\n"
-            
             try:
-                with open('traffic_log.txt', 'a') as log_file:
-                    log_file.write(log_entry)
-            except Exception as e:
-                print(f"Error writing to log file: {e}")
-            
-            print(f"Received: {data.decode()}")
-            print(f"Logged: {log_entry.strip()}")
-            conn.sendall(data)
-    except ConnectionResetError:
-        print(f"Connection with {addr} closed by client.")
+                nbytes = os.splice(fd, pipe_w, RECV_BUFFER_SIZE, flags=flags)
+            except BlockingIOError:
+                await wait_fd(loop.add_reader, loop.remove_reader, fd)
+                continue
+            if not nbytes:
+                break
+
+            log_packet(nbytes)
+
+            # Drain the pipe back into the socket before reading more
+            pending = nbytes
+            while pending:
+                try:
+                    pending -= os.splice(pipe_r, fd, pending, flags=flags)
+                except BlockingIOError:
+                    await wait_fd(loop.add_writer, loop.remove_writer, fd)
+    except (ConnectionResetError, BrokenPipeError):
+        logger.info("Connection with %s closed by client.", addr)
     finally:
+        os.close(pipe_r)
+        os.close(pipe_w)
         conn.close()
 
-def start_server():
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server_socket.bind(('127.0.0.1', 12345))
-    server_socket.listen()
+async def serve_splice(listen_sock):
+    """Accept connections on listen_sock and echo each one with splice_echo."""
+    loop = asyncio.get_running_loop()
+    connections = set()
+    while True:
+        conn, addr = await loop.sock_accept(listen_sock)
+        logger.info("Connected by %s", addr)
+        conn.setblocking(False)
+        configure_socket(conn)
+        task = asyncio.create_task(splice_echo(conn, addr))
+        connections.add(task)
+        task.add_done_callback(connections.discard)
 
-    print("Server listening on 127.0.0.1:12345")
+async def start_server(use_splice=HAS_SPLICE):
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(concurrent.futures.ThreadPoolExecutor(max_workers=THREAD_POOL_SIZE))
+    listen_sock = create_listen_socket(('127.0.0.1', 12345))
 
-    while True:
-        conn, addr = server_socket.accept()
-        client_thread = threading.Thread(target=handle_client, args=(conn, addr))
-        client_thread.start()
+    logger.info("Server listening on 127.0.0.1:12345")
+
+    with open(LOG_FILE, 'ab') as log_file:
+        writer_task = asyncio.create_task(log_writer(log_file))
+        try:
+            if use_splice:
+                with listen_sock:
+                    await serve_splice(listen_sock)
+            else:
+                server = await loop.create_server(EchoProtocol, sock=listen_sock)
+                try:
+                    await loop.create_future()  # Serve until cancelled
+                finally:
+                    # wait_closed() waits for every connection, so close them first
+                    server.close()
+                    server.close_clients()
+                    await server.wait_closed()
+        finally:
+            # Flush whatever is still queued before exiting
+            _log_q.put_nowait(None)
+            await writer_task
 
 if __name__ == "__main__":
-    start_server()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Network Traffic Echo Server')
+    parser.add_argument('--verbose', action='store_true',
+                        help='Log every received packet (default: off)')
+    parser.add_argument('--no-splice', action='store_true',
+                        help='Echo through a userspace buffer even where os.splice is available')
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+                        format='%(message)s')
+
+    try:
+        asyncio.run(start_server(use_splice=HAS_SPLICE and not args.no_splice))
+    except KeyboardInterrupt:
+        pass